@@ -1,584 +1,359 @@
 #!/usr/bin/env python3
 import os
 import re
+import sys
 import subprocess
-import pathlib
 import shutil
 import argparse
+import contextlib
+import tempfile
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
+from functools import lru_cache
+from exiftool_daemon import ExifToolDaemon
+from spatial_common import DEFAULT_JOBS, positive_int, stream_command
 
-def apply_lens_correction(input_dir='files', lens_params="k1=-0.2:k2=-0.025"):
-	"""
-	Apply lens correction to all files in the specified directory using FFmpeg.
-
-	Args:
-		input_dir (str): Directory containing files to process
-		lens_params (str): Lens correction parameters for FFmpeg
-	"""
-	# Ensure input directory exists
-	if not os.path.isdir(input_dir):
-		print(f"Error: Directory '{input_dir}' not found.")
-		return
-
-	# Create full path to input directory
-	input_dir_path = os.path.join(os.getcwd(), input_dir)
-
-	# Get list of all files in the directory
-	files = [f for f in os.listdir(input_dir_path) if os.path.isfile(os.path.join(input_dir_path, f))]
-
-	if not files:
-		print(f"No files found in '{input_dir}'.")
-		return
-
-	print(f"Found {len(files)} files in '{input_dir}'.")
-
-	# Process each file
-	for i, filename in enumerate(files, 1):
-		input_file = os.path.join(input_dir_path, filename)
-
-		# Generate output filename with "-corrected" suffix
-		file_path = pathlib.Path(filename)
-		output_filename = f"{file_path.stem}-corrected{file_path.suffix}"
-		output_file = os.path.join(input_dir_path, output_filename)
-
-		# Build FFmpeg command
-		ffmpeg_cmd = [
-			"ffmpeg",
-			"-i", input_file,
-			"-vf", f"lenscorrection={lens_params}",
-			"-q:v", "2",
-			"-y",  # Overwrite output file if it exists
-			output_file
-		]
+# OpenCV is optional, it is only needed for --lens-backend opencv
+try:
+	import cv2
+	import numpy as np
+except ImportError:
+	cv2 = None
 
-		print(f"[{i}/{len(files)}] Processing: {filename} -> {output_filename}")
+LENS_BACKENDS = ('ffmpeg', 'opencv')
 
-		try:
-			# Run FFmpeg command
-			subprocess.run(ffmpeg_cmd, check=True, capture_output=True)
-			print(f"Successfully processed {filename}")
-		except subprocess.CalledProcessError as e:
-			print(f"Error processing {filename}: {e}")
-			print(f"FFmpeg output: {e.stderr.decode()}")
-		except Exception as e:
-			print(f"Unexpected error processing {filename}: {e}")
-
-def copy_exif_tags(source_dir='a', dest_dir=None):
+def _parse_lens_params(lens_params):
 	"""
-	Copy exif tags from original files to their corresponding -corrected files.
-
-	For each file 'filename.ext' in the source directory, find the corresponding
-	'filename-sbs.tiff' file and copy all exif tags from the original to the corrected file.
+	Parse FFmpeg lenscorrection parameters ("k1=-0.2:k2=-0.025") into a tuple of
+	(cx, cy, k1, k2), or None if they use options the in-process correction doesn't support.
+	"""
+	params = {'cx': 0.5, 'cy': 0.5, 'k1': 0.0, 'k2': 0.0}
+	for option in lens_params.split(':'):
+		key, _, value = option.partition('=')
+		if key not in params:
+			return None
+		params[key] = float(value)
+	return params['cx'], params['cy'], params['k1'], params['k2']
+
+@lru_cache(maxsize=None)
+def _lens_correction_maps(width, height, cx, cy, k1, k2):
+	"""
+	Build the remap tables for FFmpeg's lenscorrection model for one image size.
 
-	Args:
-		source_dir (str): Directory containing original files
-		dest_dir (str, optional): Directory containing corrected files. If None, uses source_dir.
+	Every image from the same camera has the same size, so the tables are computed
+	once and reused for the whole batch.
 	"""
-	# Ensure source directory exists
-	if not os.path.isdir(source_dir):
-		print(f"Error: Source directory '{source_dir}' not found.")
-		return
+	xcenter = int(cx * width)
+	ycenter = int(cy * height)
+	off_x = np.arange(width, dtype=np.float32) - xcenter
+	off_y = np.arange(height, dtype=np.float32)[:, np.newaxis] - ycenter
 
-	# If destination directory not specified, use the same as source
-	if dest_dir is None:
-		dest_dir = source_dir
-	elif not os.path.isdir(dest_dir):
-		print(f"Error: Destination directory '{dest_dir}' not found.")
-		return
+	# radius is normalized so it is 1 in the corners, like FFmpeg does
+	r2 = (off_x * off_x + off_y * off_y) * (4.0 / (width * width + height * height))
+	radius_mult = 1 + k1 * r2 + k2 * r2 * r2
 
-	# Get absolute paths
-	source_dir_path = os.path.abspath(source_dir)
-	dest_dir_path = os.path.abspath(dest_dir)
+	map_x = xcenter + radius_mult * off_x
+	map_y = ycenter + radius_mult * off_y
+	return cv2.convertMaps(map_x, map_y, cv2.CV_16SC2)
 
-	# Get all files in source directory
-	source_files = [f for f in os.listdir(source_dir_path) if os.path.isfile(os.path.join(source_dir_path, f))]
+def _correct_in_process(input_file, output_file, lens_params):
+	"""
+	Apply lens correction to a single file with OpenCV using cached remap tables.
+	"""
+	# FFmpeg ignores the EXIF orientation, so do the same
+	img = cv2.imread(input_file, cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+	if img is None:
+		raise OSError(f"Could not read image '{input_file}'")
 
-	if not source_files:
-		print(f"No files found in source directory '{source_dir}'.")
-		return
+	height, width = img.shape[:2]
+	map1, map2 = _lens_correction_maps(width, height, *lens_params)
+	corrected = cv2.remap(img, map1, map2, cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT)
 
-	# Process files
-	success_count = 0
-	skipped_count = 0
-	error_count = 0
-
-	for source_file in source_files:
-		# Get the base name and extension
-		base_name, extension = os.path.splitext(source_file)
-
-		# Skip files that already have -corrected in their name
-		if base_name.endswith('-corrected') or base_name.endswith('-sbs'):
-			print(f"Skipping {source_file} - already a corrected file.")
-			skipped_count += 1
-			continue
-
-		# Generate the corrected filename
-		corrected_file = f"{base_name}-sbs.tiff"
-		corrected_path = os.path.join(dest_dir_path, corrected_file)
-
-		# Check if the corrected file exists
-		if not os.path.exists(corrected_path):
-			print(f"Skipping {source_file} - corresponding corrected file not found: {corrected_file}")
-			skipped_count += 1
-			continue
-
-		source_path = os.path.join(source_dir_path, source_file)
-
-		# Build exiftool command
-		command = [
-			"exiftool",
-			"-overwrite_original",  # Don't create backup files
-			"-TagsFromFile",
-			source_path,
-			"-all:all>all:all",            # Copy all tags
-			corrected_path
-		]
-
-		print(f"Processing: {source_file} → {corrected_file}")
+	if not cv2.imwrite(output_file, corrected, [cv2.IMWRITE_JPEG_QUALITY, 95]):
+		raise OSError(f"Could not write image '{output_file}'")
 
-		try:
-			# Run exiftool command
-			result = subprocess.run(command, check=True, capture_output=True, text=True)
-			print(f"Successfully copied tags from {source_file} to {corrected_file}")
-			if result.stdout:
-				print(f"  Output: {result.stdout.strip()}")
-			success_count += 1
-		except subprocess.CalledProcessError as e:
-			print(f"Error copying tags from {source_file} to {corrected_file}:")
-			if e.stdout:
-				print(f"  Output: {e.stdout.strip()}")
-			if e.stderr:
-				print(f"  Error: {e.stderr.strip()}")
-			error_count += 1
-		except Exception as e:
-			print(f"Unexpected error processing {source_file}: {e}")
-			error_count += 1
-
-	print("\nTag copying summary:")
-	print(f"Total source files: {len(source_files)}")
-	print(f"Successfully processed: {success_count}")
-	print(f"Skipped: {skipped_count}")
-	print(f"Errors: {error_count}")
-
-def set_datetime_from_filename(directory='a', pattern=r'IMG(\d{8})-(\d{6})'):
+def _correct_batch(files, lens_params, verbose=False, dry_run=False, backend='ffmpeg'):
 	"""
-	Set EXIF date/time tags based on dates embedded in filenames.
+	Run FFmpeg lens correction on several files with a single FFmpeg process,
+	raising CalledProcessError on failure.
 
-	The script looks for filenames matching the pattern and extracts date and time information
-	to set the following EXIF tags: DateTimeOriginal, CreateDate, and ModifyDate.
+	Each input gets its own lenscorrection chain in one filter graph, mapped to its
+	own output, so FFmpeg is only started and initialized once per batch. If the batch
+	fails, each file is retried on its own, so one bad input doesn't fail the others.
+	With the opencv backend the same correction is done in-process instead.
 
 	Args:
-		directory (str): Directory containing the image files
-		pattern (str): Regular expression pattern to extract date and time from filenames
+		files (list[tuple[str, str]]): (input_file, output_file) pairs
+		lens_params (str): Lens correction parameters for FFmpeg
+		verbose (bool): If True, show FFmpeg's output
 		dry_run (bool): If True, only show what would be done without making changes
-	"""
-	# Ensure directory exists
-	if not os.path.isdir(directory):
-		print(f"Error: Directory '{directory}' not found.")
-		return
-
-	# Get absolute path
-	dir_path = os.path.abspath(directory)
+		backend (str): 'ffmpeg', or 'opencv' to correct in-process
 
-	# Compile the regex pattern
-	regex = re.compile(pattern)
+	Raises:
+		ValueError: If the opencv backend doesn't support lens_params
+	"""
+	if backend == 'opencv':
+		parsed_params = _parse_lens_params(lens_params)
+		if parsed_params is None:
+			raise ValueError(f"Lens correction parameters '{lens_params}' are not supported by the opencv backend")
+
+		for input_file, output_file in files:
+			if dry_run:
+				print(f"Lens correct in-process: {input_file} -> {output_file}")
+			else:
+				_correct_in_process(input_file, output_file, parsed_params)
+		return None
 
-	# Get all files in the directory
-	files = [f for f in os.listdir(dir_path)
-			if os.path.isfile(os.path.join(dir_path, f))
-			and (f.lower().endswith('-sbs.tiff'))]
+	ffmpeg_cmd = [
+		"ffmpeg",
+		"-loglevel", "error",
+		"-y"  # Overwrite output files if they exist
+	]
+	for input_file, _ in files:
+		ffmpeg_cmd += ["-i", input_file]
 
-	if not files:
-		print(f"No files found in directory '{directory}'.")
-		return
+	ffmpeg_cmd += ["-filter_complex", ";".join(f"[{i}:v]lenscorrection={lens_params}[v{i}]" for i in range(len(files)))]
 
-	# Process files
-	success_count = 0
-	skipped_count = 0
-	error_count = 0
+	for i, (_, output_file) in enumerate(files):
+		ffmpeg_cmd += ["-map", f"[v{i}]", "-q:v", "2", output_file]
 
-	for filename in files:
-		# Try to match the pattern
-		match = regex.search(filename)
-		if not match:
-			print(f"Skipping {filename} - does not match the expected pattern.")
-			skipped_count += 1
-			continue
+	try:
+		return stream_command(ffmpeg_cmd, verbose, dry_run)
+	except subprocess.CalledProcessError:
+		if len(files) == 1:
+			raise
 
-		# Extract date and time parts
+	error = None
+	for file in files:
 		try:
-			date_part = match.group(1)  # YYYYMMDD
-			time_part = match.group(2)  # HHMMSS
-
-			# Parse date and time
-			year = date_part[0:4]
-			month = date_part[4:6]
-			day = date_part[6:8]
-
-			hour = time_part[0:2]
-			minute = time_part[2:4]
-			second = time_part[4:6]
-
-			# Format for exiftool: "YYYY:MM:DD HH:MM:SS"
-			exif_datetime = f"{year}:{month}:{day} {hour}:{minute}:{second}"
-
-			# Validate the date and time
-			datetime.strptime(exif_datetime, "%Y:%m:%d %H:%M:%S")
-
-			file_path = os.path.join(dir_path, filename)
-
-			print(f"Processing: {filename}")
-			print(f"  Extracted datetime: {exif_datetime}")
-
-			# Build exiftool command to set multiple date/time tags
-			command = [
-				"exiftool",
-				"-overwrite_original",
-				"-DateTimeOriginal=" + exif_datetime,
-				"-CreateDate=" + exif_datetime,
-				"-ModifyDate=" + exif_datetime,
-				file_path
-			]
-
-			# Run exiftool command
-			result = subprocess.run(command, check=True, capture_output=True, text=True)
-			print(f"  Successfully set date/time for {filename}")
-			if result.stdout:
-				print(f"  Output: {result.stdout.strip()}")
-			success_count += 1
-
-		except ValueError as e:
-			print(f"Error parsing date/time from {filename}: {e}")
-			error_count += 1
+			_correct_batch([file], lens_params, verbose, dry_run)
 		except subprocess.CalledProcessError as e:
-			print(f"Error setting date/time for {filename}:")
-			if e.stdout:
-				print(f"  Output: {e.stdout.strip()}")
-			if e.stderr:
-				print(f"  Error: {e.stderr.strip()}")
-			error_count += 1
-		except Exception as e:
-			print(f"Unexpected error processing {filename}: {e}")
-			error_count += 1
-
-	print("\nDate/time setting summary:")
-	print(f"Total files: {len(files)}")
-	print(f"Successfully processed: {success_count}")
-	print(f"Skipped (no match): {skipped_count}")
-	print(f"Errors: {error_count}")
-
-def match_and_rename_files(dir_a='a', dir_b='b'):
-	"""
-	Match files between two directories based on their number identifier and
-	rename files in directory B to use the same prefix as their counterparts in directory A.
+			error = error or e
+	if error is not None:
+		raise error
+	return None
 
-	Files are expected to follow the pattern 'prefix-number.extension'.
+def _copy_exif_args(source_path, corrected_path):
+	"""
+	Build the exiftool arguments to copy all exif tags from source_path to corrected_path.
+	"""
+	return [
+		"-overwrite_original",  # Don't create backup files
+		"-TagsFromFile",
+		source_path,
+		"-all:all>all:all",            # Copy all tags
+		corrected_path
+	]
+
+def datetime_from_filename(filename, regex):
+	"""
+	Extract an exiftool formatted date/time ("YYYY:MM:DD HH:MM:SS") from a filename.
 
 	Args:
-		dir_a (str): Path to the source directory containing reference files
-		dir_b (str): Path to the directory containing files to be renamed
+		filename (str): Filename to search
+		regex (re.Pattern): Compiled pattern capturing the date (YYYYMMDD) and time (HHMMSS)
+
+	Returns:
+		str | None: The formatted date/time, or None if the filename doesn't match
+
+	Raises:
+		ValueError: If the extracted date/time is not valid
 	"""
-	# Ensure both directories exist
-	if not os.path.isdir(dir_a):
-		print(f"Error: Directory '{dir_a}' not found.")
-		return
+	match = regex.search(filename)
+	if not match:
+		return None
 
-	if not os.path.isdir(dir_b):
-		print(f"Error: Directory '{dir_b}' not found.")
-		return
+	date_part = match.group(1)  # YYYYMMDD
+	time_part = match.group(2)  # HHMMSS
 
-	# Get full paths to directories
-	dir_a_path = os.path.abspath(dir_a)
-	dir_b_path = os.path.abspath(dir_b)
+	# Parse date and time
+	year = date_part[0:4]
+	month = date_part[4:6]
+	day = date_part[6:8]
 
-	# Dictionary to store files in directory A by their number identifier
-	files_a = {}
+	hour = time_part[0:2]
+	minute = time_part[2:4]
+	second = time_part[4:6]
 
-	# Regular expression to extract prefix, number, and extension
-	pattern = re.compile(r'(.+)-(\d+)-corrected\.(.+)')
-
-	# Process files in directory A
-	print(f"Scanning directory '{dir_a}'...")
-	for filename in os.listdir(dir_a_path):
-		if os.path.isfile(os.path.join(dir_a_path, filename)):
-			match = pattern.match(filename)
-			if match:
-				prefix_a, number, extension = match.groups()
-				files_a[number] = {
-					'filename': filename,
-					'prefix': prefix_a,
-					'extension': extension
-				}
-
-	if not files_a:
-		print(f"No matching files found in directory '{dir_a}'.")
-		return
+	# Format for exiftool: "YYYY:MM:DD HH:MM:SS"
+	exif_datetime = f"{year}:{month}:{day} {hour}:{minute}:{second}"
 
-	print(f"Found {len(files_a)} matching files in directory '{dir_a}'.")
-
-	# Process and rename files in directory B
-	print(f"\nScanning directory '{dir_b}'...")
-	renamed_count = 0
-	skipped_count = 0
-	errors_count = 0
-
-	for filename in os.listdir(dir_b_path):
-		file_path = os.path.join(dir_b_path, filename)
-		if os.path.isfile(file_path):
-			match = pattern.match(filename)
-			if match:
-				prefix_b, number, extension = match.groups()
-
-				# Check if there's a matching file in directory A
-				if number in files_a:
-					# Get the prefix from directory A
-					new_prefix = files_a[number]['prefix']
-
-					# Skip if the prefixes are already the same
-					if prefix_b == new_prefix:
-						print(f"Skipping {filename} - prefix already matches.")
-						skipped_count += 1
-						continue
-
-					# Create new filename
-					new_filename = f"{new_prefix}-{number}-corrected.{extension}"
-					new_file_path = os.path.join(dir_b_path, new_filename)
-
-					# Rename the file
-					try:
-						shutil.move(file_path, new_file_path)
-						print(f"Renamed: {filename} -> {new_filename}")
-						renamed_count += 1
-					except Exception as e:
-						print(f"Error renaming {filename}: {e}")
-						errors_count += 1
-				else:
-					print(f"No match found in directory '{dir_a}' for number {number} ({filename}).")
-			else:
-				print(f"Skipping {filename} - doesn't match expected pattern 'prefix-number.extension'.")
+	# Validate the date and time
+	datetime.strptime(exif_datetime, "%Y:%m:%d %H:%M:%S")
 
-	print("\nSummary:")
-	print(f"Total files in directory '{dir_a}': {len(files_a)}")
-	print(f"Files renamed: {renamed_count}")
-	print(f"Files skipped (already matching): {skipped_count}")
-	print(f"Errors: {errors_count}")
+	return exif_datetime
 
-def align_stereo_files(dir_a='a', dir_b='b'):
+def _set_datetime_args(file_path, exif_datetime):
+	"""
+	Build the exiftool arguments to set the EXIF date/time tags of file_path.
+	"""
+	return [
+		"-overwrite_original",
+		"-DateTimeOriginal=" + exif_datetime,
+		"-CreateDate=" + exif_datetime,
+		"-ModifyDate=" + exif_datetime,
+		file_path
+	]
+
+def _align_one(file_a, file_b, output_file, verbose=False, dry_run=False):
+	"""
+	Run StereoAutoAlign on a single stereo pair, raising CalledProcessError on failure.
+	"""
+	command = [
+		"StereoAutoAlign",
+		file_a, file_b,
+		"10",
+		output_file
+	]
+	return stream_command(command, verbose, dry_run)
+
+def _spatialize_one(file, baseline, hfov, verbose=False, dry_run=False):
+	"""
+	Run spatialPhotoTool on a single stereo image, raising CalledProcessError on failure.
+	"""
+	command = [
+		"spatialPhotoTool",
+		"-b", str(baseline),
+		"--hfov", str(hfov),
+		file
+	]
+	return stream_command(command, verbose, dry_run)
+
+@dataclass
+class Pair:
 	"""
-	Find matching files for stereo pairs in directories 'a' and 'b' and process them
-	with StereoAutoAlign.
+	A matched left/right stereo pair and the files the pipeline produces for it.
+	"""
+	left_src: str
+	right_src: str
+	left_corrected: str
+	right_corrected: str
+	sbs_tiff: str
+	heic_out: str
+
+	@property
+	def name(self):
+		return os.path.basename(self.left_src)
+
+def find_pairs(dir_a='a', dir_b='b', scratch_dir=None):
+	"""
+	Match original files between two directories based on their number identifier.
+
+	Files are expected to follow the pattern 'prefix-number.extension'. The right side
+	intermediate is named with the left prefix so both sides of a pair share a name,
+	which makes a separate renaming pass unnecessary.
 
 	Args:
-		dir_a (str): Path to the first directory
-		dir_b (str): Path to the second directory
+		dir_a (str): Path to the left directory, whose prefixes and metadata are kept
+		dir_b (str): Path to the right directory
+		scratch_dir (str, optional): Directory for the -corrected intermediates. If None,
+			they are written next to the originals.
+
+	Returns:
+		list[Pair]: Matched pairs, sorted by the left filename
 	"""
-	# Ensure both directories exist
-	if not os.path.isdir(dir_a):
-		print(f"Error: Directory '{dir_a}' not found.")
-		return
+	# Regular expression to extract prefix, number, and extension
+	match_name = re.compile(r'(.+)-(\d+)\.(.+)').match
 
-	if not os.path.isdir(dir_b):
-		print(f"Error: Directory '{dir_b}' not found.")
-		return
+	def scan(dir_path):
+		with os.scandir(dir_path) as entries:
+			return {
+				match.group(2): entry
+				for entry in entries if entry.is_file()
+				for match in (match_name(entry.name),) if match
+			}
 
-	# Get full paths to directories
 	dir_a_path = os.path.abspath(dir_a)
 	dir_b_path = os.path.abspath(dir_b)
-
-	# Get list of filenames in both directories
-	files_a = {f for f in os.listdir(dir_a_path) if os.path.isfile(os.path.join(dir_a_path, f))}
-	files_b = {f for f in os.listdir(dir_b_path) if os.path.isfile(os.path.join(dir_b_path, f))}
-
-	# Find matching filenames
-	matching_files = set()
-	for file in files_a.intersection(files_b):
-		# Check if the file has '-corrected' in the name (but before the extension)
-		name, _ = os.path.splitext(file)
-		if name.endswith('-corrected'):
-			matching_files.add(file)
-
-	if not matching_files:
-		print("No matching filenames found between the two directories.")
-		return
-
-	print(f"Found {len(matching_files)} matching files in both directories.")
-
-	# Process each matching file
-	success_count = 0
-	error_count = 0
-
-	for i, filename in enumerate(sorted(matching_files), 1):
-		file_a = os.path.join(dir_a_path, filename)
-		file_b = os.path.join(dir_b_path, filename)
-
-		name, _ = os.path.splitext(filename)
-		name = name.replace('-corrected', '-sbs')
-		output_file = os.path.join(dir_a_path, name + '.tiff')
-
-		# Build command
-		command = [
-			"StereoAutoAlign",
-			file_a, file_b,
-			"10",
-			output_file
-		]
-
-		print(f"\n[{i}/{len(matching_files)}] Processing: {filename}")
-		print(f"Command: {' '.join(command)}")
-
-		try:
-			# Run the command
-			result = subprocess.run(command, check=True, capture_output=True, text=True)
-			print(f"Successfully processed {filename}")
-			if result.stdout:
-				print("Output:", result.stdout)
-			success_count += 1
-		except subprocess.CalledProcessError as e:
-			print(f"Error processing {filename}: {e}")
-			if e.stdout:
-				print("Output:", e.stdout)
-			if e.stderr:
-				print("Error:", e.stderr)
-			error_count += 1
-		except Exception as e:
-			print(f"Unexpected error processing {filename}: {e}")
-			error_count += 1
-
-	print("\nProcessing summary:")
-	print(f"Total matching files: {len(matching_files)}")
-	print(f"Successfully processed: {success_count}")
-	print(f"Errors: {error_count}")
-
-def process_stereo_files(dir='a', baseline=73, hfov=170):
+	files_a = scan(dir_a_path)
+	files_b = scan(dir_b_path)
+
+	# Only numbers present in both directories can pair up, so intersect the keys
+	# once instead of looking every file of dir_a up in dir_b
+	for number in sorted(files_a.keys() - files_b.keys()):
+		print(f"No match found in directory '{dir_b}' for number {number} ({files_a[number].name}).")
+
+	pairs = []
+	for number in files_a.keys() & files_b.keys():
+		entry_a = files_a[number]
+		entry_b = files_b[number]
+
+		stem, extension = os.path.splitext(entry_a.name)
+		_, extension_b = os.path.splitext(entry_b.name)
+		if scratch_dir is None:
+			left_corrected = os.path.join(dir_a_path, f"{stem}-corrected{extension}")
+			right_corrected = os.path.join(dir_b_path, f"{stem}-corrected{extension_b}")
+		else:
+			left_corrected = os.path.join(scratch_dir, f"{stem}-left-corrected{extension}")
+			right_corrected = os.path.join(scratch_dir, f"{stem}-right-corrected{extension_b}")
+
+		pairs.append(Pair(
+			left_src=entry_a.path,
+			right_src=entry_b.path,
+			left_corrected=left_corrected,
+			right_corrected=right_corrected,
+			sbs_tiff=os.path.join(dir_a_path, f"{stem}-sbs.tiff"),
+			heic_out=os.path.join(dir_a_path, f"{stem}-sbs.heic")
+		))
+
+	pairs.sort(key=lambda pair: pair.left_src)
+	return pairs
+
+def process_pair(pair, exiftool, lens_params="k1=-0.2:k2=-0.025", baseline=73, hfov=170, exif_datetime=None, verbose=False, dry_run=False, lens_backend='ffmpeg'):
 	"""
-	Find stereo images and processes them with spatialPhotoTool.
+	Run a single stereo pair through every stage of the pipeline: lens correction,
+	alignment, EXIF restore, date/time setting and spatial photo creation.
+
+	The -corrected intermediates are removed as soon as alignment succeeds.
 
 	Args:
-		dir (str): Path to the directory to search
+		pair (Pair): The stereo pair to process
+		exiftool (ExifToolDaemon): Running exiftool shared between pairs
+		lens_params (str): Lens correction parameters for FFmpeg
 		baseline (int): The baseline parameter for spatialPhotoTool (-b)
 		hfov (int): The horizontal field of view parameter for spatialPhotoTool (--hfov)
-	"""
-	# Ensure both directories exist
-	if not os.path.isdir(dir):
-		print(f"Error: Directory '{dir}' not found.")
-		return
-
-	# Get full paths to directories
-	dir_path = os.path.abspath(dir)
-
-	# Get list of filenames in both directories
-	files = {f for f in os.listdir(dir_path) if os.path.isfile(os.path.join(dir_path, f))}
-
-	# Find matching filenames
-	matching_files = set()
-	for file in files:
-		# Check if the file has '-sbs' in the name (but before the extension)
-		name, _ = os.path.splitext(file)
-		if name.endswith('-sbs'):
-			matching_files.add(file)
-
-	if not matching_files:
-		print("No stereo filenames found.")
-		return
-
-	print(f"Found {len(matching_files)} stereo files.")
-	print(f"Using parameters: baseline={baseline}, hfov={hfov}")
+		exif_datetime (str, optional): Validated date/time to set on the output, in exiftool's format
+		verbose (bool): If True, show the output of the external tools
+		dry_run (bool): If True, only show what would be done without making changes
+		lens_backend (str): Lens correction implementation, 'ffmpeg' or 'opencv'
 
-	# Process each matching file
-	success_count = 0
-	error_count = 0
+	Raises:
+		subprocess.CalledProcessError: If any of the external tools fail
+		FileNotFoundError: If spatialPhotoTool succeeded without writing the spatial photo
+	"""
+	_correct_batch([(pair.left_src, pair.left_corrected), (pair.right_src, pair.right_corrected)], lens_params, verbose, dry_run, lens_backend)
 
-	for i, filename in enumerate(sorted(matching_files), 1):
-		file = os.path.join(dir_path, filename)
+	_align_one(pair.left_corrected, pair.right_corrected, pair.sbs_tiff, verbose, dry_run)
+	if not dry_run:
+		os.unlink(pair.left_corrected)
+		os.unlink(pair.right_corrected)
 
-		# Build command
-		command = [
-			"spatialPhotoTool",
-			"-b", str(baseline),
-			"--hfov", str(hfov),
-			file
-		]
+	# Restore the metadata and set the date/time with a single exiftool batch
+	commands = [_copy_exif_args(pair.left_src, pair.sbs_tiff)]
+	if exif_datetime is not None:
+		commands.append(_set_datetime_args(pair.sbs_tiff, exif_datetime))
 
-		print(f"\n[{i}/{len(matching_files)}] Processing: {filename}")
-		print(f"Command: {' '.join(command)}")
+	for args, output in zip(commands, exiftool.execute_many(commands)):
+		if ExifToolDaemon.errors(output):
+			raise subprocess.CalledProcessError(1, [exiftool.executable, *args], output)
 
-		try:
-			# Run the command
-			result = subprocess.run(command, check=True, capture_output=True, text=True)
-			print(f"Successfully processed {filename}")
-			if result.stdout:
-				print("Output:", result.stdout)
-			success_count += 1
-		except subprocess.CalledProcessError as e:
-			print(f"Error processing {filename}: {e}")
-			if e.stdout:
-				print("Output:", e.stdout)
-			if e.stderr:
-				print("Error:", e.stderr)
-			error_count += 1
-		except Exception as e:
-			print(f"Unexpected error processing {filename}: {e}")
-			error_count += 1
-
-	print("\nProcessing summary:")
-	print(f"Total matching files: {len(matching_files)}")
-	print(f"Successfully processed: {success_count}")
-	print(f"Errors: {error_count}")
-
-def move_heic_files(dir_a='a'):
-	"""
-	Move all .heic files from the specified directory to the current directory.
+	_spatialize_one(pair.sbs_tiff, baseline, hfov, verbose, dry_run)
 
-	Args:
-		dir_a (str): Path to the directory containing .heic files
-	"""
-	# Ensure directory exists
-	if not os.path.isdir(dir_a):
-		print(f"Error: Directory '{dir_a}' not found.")
+	if dry_run:
 		return
 
-	# Get full paths
-	dir_a_path = os.path.abspath(dir_a)
-	current_dir = os.getcwd()
+	if not os.path.exists(pair.heic_out):
+		raise FileNotFoundError(f"spatialPhotoTool did not create '{pair.heic_out}'")
 
-	# Find all .heic files (case insensitive)
-	heic_files = []
-	for filename in os.listdir(dir_a_path):
-		if os.path.isfile(os.path.join(dir_a_path, filename)) and filename.lower().endswith('.heic'):
-			heic_files.append(filename)
-
-	if not heic_files:
-		print(f"No .heic files found in '{dir_a}'.")
+	# Move the spatial photo to the current directory unless one is already there
+	heic_name = os.path.basename(pair.heic_out)
+	dest_path = os.path.join(os.getcwd(), heic_name)
+	if os.path.exists(dest_path):
+		print(f"Skipping {heic_name} - already exists in current directory.")
 		return
 
-	print(f"\nMoving {len(heic_files)} .heic files from '{dir_a}' to the current directory...")
-
-	# Move each file
-	success_count = 0
-	error_count = 0
-
-	for filename in heic_files:
-		source_path = os.path.join(dir_a_path, filename)
-		dest_path = os.path.join(current_dir, filename)
-
-		# Check if file already exists in destination
-		if os.path.exists(dest_path):
-			print(f"Skipping {filename} - already exists in current directory.")
-			continue
-
-		try:
-			import shutil
-			shutil.move(source_path, dest_path)
-			print(f"Moved: {filename}")
-			success_count += 1
-		except Exception as e:
-			print(f"Error moving {filename}: {e}")
-			error_count += 1
-
-	print(f"\nFile moving summary:")
-	print(f"Total .heic files: {len(heic_files)}")
-	print(f"Successfully moved: {success_count}")
-	print(f"Errors: {error_count}")
+	shutil.move(pair.heic_out, dest_path)
 
 def main():
 	# Set up command-line argument parsing
@@ -593,42 +368,87 @@ def main():
 						help='Baseline (mm) (default: 73)')
 	parser.add_argument('--hfov', '-f', type=int, default=170,
 						help='Horizontal Field of View (Degrees) (default: 170)')
+	parser.add_argument('--jobs', '-j', type=positive_int, default=DEFAULT_JOBS,
+						help=f'Number of external tools to run concurrently (default: {DEFAULT_JOBS})')
+	parser.add_argument('--verbose', '-v', action='store_true',
+						help='Show the output of the external tools')
+	parser.add_argument('--dry-run', '-n', action='store_true',
+						help='Only print the commands that would be run, without changing any files')
+	parser.add_argument('--lens-backend', choices=LENS_BACKENDS, default='ffmpeg',
+						help='Lens correction implementation, opencv runs in-process but interpolates and encodes slightly differently (default: ffmpeg)')
+	parser.add_argument('--scratch-dir', type=str, default=None,
+						help='Directory for temporary lens corrected images, e.g. a RAM backed /dev/shm with room for 2 images per job (default: next to the originals)')
 	# Parse arguments
 	args = parser.parse_args()
 
+	if args.lens_backend == 'opencv' and cv2 is None:
+		parser.error("--lens-backend opencv needs OpenCV (pip install opencv-python)")
+
 	if not os.path.isdir(args.left):
 		print(f"Error: Directory '{args.left}' not found.")
-		return
+		sys.exit(1)
 	if not os.path.isdir(args.right):
 		print(f"Error: Directory '{args.right}' not found.")
-		return
-
-	print("Starting lens correction processing...")
-	apply_lens_correction(input_dir=args.left)
-	apply_lens_correction(input_dir=args.right)
-	print("Processing complete.")
-
-	print("Fixing file names...")
-	match_and_rename_files(dir_a=args.left, dir_b=args.right)
-	print("Processing complete.")
-
-	print("Starting stereo photo processing...")
-	align_stereo_files(args.left, args.right)
-	print("Processing complete.")
-
-	print("Restoring EXIF tags...")
-	copy_exif_tags(args.left)
-	print("Processing complete.")
-
-	print("Starting EXIF date/time setting process...")
-	set_datetime_from_filename(args.left, r'IMG(\d{8})-(\d{6})')
-	print("Process complete.")
-
-	print("Starting spatial photo creation...")
-	process_stereo_files(args.left, args.baseline, args.hfov)
-	print("Processing complete.")
-
-	move_heic_files(args.left)
+		sys.exit(1)
+
+	# Intermediates are deleted as soon as their pair is aligned, so the scratch directory
+	# only ever holds those of the pairs currently being processed
+	scratch = tempfile.TemporaryDirectory(prefix='a16spatial-', dir=args.scratch_dir) if args.scratch_dir else contextlib.nullcontext()
+
+	with scratch as scratch_dir:
+		pairs = find_pairs(args.left, args.right, scratch_dir)
+		if not pairs:
+			print("No matching stereo pairs found between the two directories.")
+			return
+
+		print(f"Found {len(pairs)} stereo pairs.")
+		print(f"Using parameters: baseline={args.baseline}, hfov={args.hfov}")
+
+		# Stream each pair through every stage instead of running each stage over the
+		# whole directory, so intermediates can be removed as soon as they are consumed
+		success_count = 0
+		error_count = 0
+
+		# Extract and validate every date/time before any tool runs, a bad date in a
+		# filename only loses the date, not the whole pair
+		date_regex = re.compile(r'IMG(\d{8})-(\d{6})')
+		datetimes = {}
+		for pair in pairs:
+			try:
+				datetimes[pair.name] = datetime_from_filename(os.path.basename(pair.sbs_tiff), date_regex)
+			except ValueError as e:
+				print(f"Error parsing date/time from {pair.name}: {e}")
+
+		with ExifToolDaemon(dry_run=args.dry_run) as exiftool, ThreadPoolExecutor(max_workers=args.jobs) as executor:
+			futures = {
+				executor.submit(process_pair, pair, exiftool, baseline=args.baseline, hfov=args.hfov,
+								exif_datetime=datetimes.get(pair.name), verbose=args.verbose, dry_run=args.dry_run,
+								lens_backend=args.lens_backend): pair
+				for pair in pairs
+			}
+
+			for i, future in enumerate(as_completed(futures), 1):
+				pair = futures[future]
+				try:
+					future.result()
+					print(f"[{i}/{len(pairs)}] Successfully processed {pair.name}")
+					success_count += 1
+				except subprocess.CalledProcessError as e:
+					print(f"[{i}/{len(pairs)}] Error processing {pair.name}: {e}")
+					if e.stdout:
+						print("Output:", e.stdout)
+					error_count += 1
+				except Exception as e:
+					print(f"[{i}/{len(pairs)}] Unexpected error processing {pair.name}: {e}")
+					error_count += 1
+
+		print("\nProcessing summary:")
+		print(f"Total stereo pairs: {len(pairs)}")
+		print(f"Successfully processed: {success_count}")
+		print(f"Errors: {error_count}")
+
+		if error_count:
+			sys.exit(1)
 
 if __name__ == "__main__":
 	main()
\ No newline at end of file
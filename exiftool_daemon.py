@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+import shlex
+import subprocess
+import threading
+
+class ExifToolDaemon:
+	"""
+	Run a single persistent exiftool process (-stay_open) and feed it commands over
+	stdin, instead of paying the Perl interpreter startup cost for every file.
+
+	Usage:
+		with ExifToolDaemon() as exiftool:
+			exiftool.execute("-overwrite_original", "-Orientation=1", "-n", "image.jpg")
+
+	With dry_run, no process is started and commands are only printed.
+
+	Commands are serialized, so a single instance can be shared between threads.
+	Errors and warnings are merged into the command output, since exiftool has no
+	exit status per command in this mode.
+	"""
+	READY = "{ready}"
+
+	def __init__(self, executable="exiftool", dry_run=False):
+		self.executable = executable
+		self.dry_run = dry_run
+		self.process = None
+		self.lock = threading.Lock()
+
+	def __enter__(self):
+		if self.dry_run:
+			return self
+
+		self.process = subprocess.Popen(
+			# -q drops the informational "N image files updated" lines from every command
+			[self.executable, "-stay_open", "True", "-@", "-", "-common_args", "-q"],
+			stdin=subprocess.PIPE,
+			stdout=subprocess.PIPE,
+			stderr=subprocess.STDOUT,
+			text=True
+		)
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+	def close(self):
+		"""
+		Ask exiftool to exit and wait for it.
+		"""
+		if self.process is None:
+			return
+
+		try:
+			self.process.stdin.write("-stay_open\nFalse\n")
+			self.process.stdin.flush()
+		except BrokenPipeError:
+			pass
+		self.process.communicate()
+		self.process = None
+
+	@staticmethod
+	def errors(output):
+		"""
+		Return the error lines exiftool reported in a command's output.
+		"""
+		return [line for line in output.splitlines() if line.startswith("Error")]
+
+	def _read_until_ready(self):
+		lines = []
+		for line in self.process.stdout:
+			if line.rstrip("\r\n") == self.READY:
+				return "".join(lines)
+			lines.append(line)
+		raise RuntimeError("exiftool exited unexpectedly")
+
+	def _write(self, data):
+		self.process.stdin.write(data)
+		self.process.stdin.flush()
+
+	def execute(self, *args):
+		"""
+		Run one exiftool command and return its output.
+
+		Args:
+			*args (str): Command line arguments, exactly as they would be passed to exiftool
+
+		Raises:
+			subprocess.CalledProcessError: If exiftool reports an error
+		"""
+		output = self.execute_many([args])[0]
+		if self.errors(output):
+			raise subprocess.CalledProcessError(1, [self.executable, *args], output)
+
+		return output
+
+	def execute_many(self, commands):
+		"""
+		Send a batch of exiftool commands in a single write and return their outputs.
+
+		Unlike execute(), errors are not raised, check each output with errors().
+
+		Args:
+			commands (list[list[str]]): Arguments of each command
+
+		Returns:
+			list[str]: Output of each command, in order
+		"""
+		if self.dry_run:
+			for args in commands:
+				print(shlex.join([self.executable, *args]))
+			return [""] * len(commands)
+
+		data = "".join("\n".join([*args, "-execute"]) + "\n" for args in commands)
+
+		with self.lock:
+			# write from another thread so a large batch can't deadlock against
+			# exiftool blocking on a full stdout pipe
+			writer = threading.Thread(target=self._write, args=(data,))
+			writer.start()
+			outputs = [self._read_until_ready() for _ in commands]
+			writer.join()
+
+		return outputs
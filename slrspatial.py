@@ -1,10 +1,17 @@
 #!/usr/bin/env python3
 import os
+import json
 import subprocess
 import argparse
+import contextlib
 import re
+import shutil
 import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from PIL import Image
+from exiftool_daemon import ExifToolDaemon
+from spatial_common import DEFAULT_JOBS, positive_int, stream_command
 
 def orientation_to_jpegtran_arg(orientation: int) -> list[str] | None:
 	return {
@@ -18,29 +25,111 @@ def orientation_to_jpegtran_arg(orientation: int) -> list[str] | None:
 		8: ['-rotate', '270']
 	}.get(orientation)
 
+# compiled once, natural_sort_key is called for every comparison key while sorting
+_split_numbers = re.compile(r'(\d+)').split
+
 def natural_sort_key(s):
 	"""
 	Sort strings containing numbers naturally (e.g., DSC01, DSC02, DSC10 instead of DSC01, DSC10, DSC02)
 	"""
-	return [int(text) if text.isdigit() else text.lower() for text in re.split(r'(\d+)', s)]
+	return [int(text) if text.isdigit() else text.lower() for text in _split_numbers(s)]
+
+def list_images(folder):
+	"""
+	List the JPEG images in a folder
+	"""
+	# DirEntry.is_file() uses the file type returned with the directory listing,
+	# so this doesn't need a stat() per entry
+	with os.scandir(folder) as entries:
+		return [entry.name for entry in entries
+				if entry.is_file() and entry.name.lower().endswith(('.jpg', '.jpeg'))]
+
+def run_command(command, description=None, verbose=False, dry_run=False):
+	"""
+	Run a shell command and handle errors, returns True on success
+	"""
+	if description:
+		print(f"{description}...")
+
+	try:
+		stream_command(command, verbose, dry_run)
+	except subprocess.CalledProcessError as e:
+		print(f"Error: {e}")
+		print(f"Command output: {e.stdout}")
+		return None
+
+	return True
 
-def run_command(command, description=None):
+def run_exiftool(exiftool, args, description=None):
 	"""
-	Run a shell command and handle errors
+	Run an exiftool command on a running ExifToolDaemon and handle errors
 	"""
 	if description:
 		print(f"{description}...")
 
 	try:
-		result = subprocess.run(command, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-		return result.stdout.strip()
+		return exiftool.execute(*args).strip()
 	except subprocess.CalledProcessError as e:
 		print(f"Error: {e}")
 		print(f"Command output: {e.stdout}")
-		print(f"Command error: {e.stderr}")
 		return None
 
-def process_images(folder1, folder2, crop='none', spatial_params=None):
+def rotate_image(image_path, rotated_path, transform, verbose=False):
+	"""
+	Losslessly rotate an image with jpegtran into rotated_path, returns True on success
+	"""
+	jpeg_transform_cmd = ['jpegtran', '-copy', 'all', *transform, '-outfile', rotated_path, image_path]
+	return run_command(jpeg_transform_cmd, verbose=verbose)
+
+def rotate_all(executor, folder, images, orientations, rotations, verbose=False):
+	"""
+	Queue a lossless rotation for every image in a folder whose EXIF orientation
+	needs one, each temporary output is added to rotations with its image path,
+	returns a dict of the queued futures to their temporary outputs
+	"""
+	futures = {}
+	for i, img in enumerate(images):
+		image_path = f'{folder}/{img}'
+		transform = orientation_to_jpegtran_arg(orientations.get(image_path, 1))
+		if transform:
+			print(f'{i}: Rotating: {img}')
+			# write to a temporary file next to the image, so concurrent rotations don't
+			# collide and the result can be renamed into place on the same filesystem,
+			# named so list_images can never mistake a leftover one for a photo
+			fd, rotated_path = tempfile.mkstemp(dir=folder, prefix='.rotating-', suffix='.tmp')
+			os.close(fd)
+			rotations[rotated_path] = image_path
+			futures[executor.submit(rotate_image, image_path, rotated_path, transform, verbose)] = rotated_path
+	return futures
+
+def read_orientations(exiftool, image_paths):
+	"""
+	Read the EXIF orientation of many images with a single exiftool command,
+	images exiftool couldn't read are reported and left out of the result
+	"""
+	if not image_paths:
+		return {}
+
+	# an error on one image must not throw away the orientations of all the others,
+	# so report the error lines and parse the JSON entries exiftool did return
+	output = exiftool.execute_many([['-j', '-Orientation#', *image_paths]])[0]
+	errors = ExifToolDaemon.errors(output)
+	for error in errors:
+		print(error)
+
+	json_output = "\n".join(line for line in output.splitlines() if line not in errors)
+	if not json_output.strip():
+		return {}
+
+	try:
+		entries = json.loads(json_output)
+	except json.JSONDecodeError as e:
+		print(f"Error: Could not parse the exiftool orientation output: {e}")
+		return {}
+
+	return {entry['SourceFile']: int(entry.get('Orientation', 1)) for entry in entries if 'Error' not in entry}
+
+def process_images(folder1, folder2, crop='none', spatial_params=None, jobs=DEFAULT_JOBS, verbose=False, dry_run=False):
 	"""
 	Process images in two folders:
 	1. Ensure both folders have the same number of images
@@ -49,6 +138,8 @@ def process_images(folder1, folder2, crop='none', spatial_params=None):
 	4. Crop Images
 	5. Copy EXIF data to output images
 	6. Run spatialPhotoTool on matching image pairs
+
+	With dry_run, the commands are printed and no files are changed
 	"""
 	# Ensure the folders exist
 	if not os.path.isdir(folder1):
@@ -60,12 +151,8 @@ def process_images(folder1, folder2, crop='none', spatial_params=None):
 		sys.exit(1)
 
 	# Get all image files in both folders
-	image_extensions = ('.jpg', '.jpeg', '.JPG', '.JPEG')
-
-	folder1_images = [f for f in os.listdir(folder1) if os.path.isfile(os.path.join(folder1, f))
-					and f.lower().endswith(image_extensions)]
-	folder2_images = [f for f in os.listdir(folder2) if os.path.isfile(os.path.join(folder2, f))
-					and f.lower().endswith(image_extensions)]
+	folder1_images = list_images(folder1)
+	folder2_images = list_images(folder2)
 
 	# Sort images naturally
 	folder1_images.sort(key=natural_sort_key)
@@ -85,47 +172,63 @@ def process_images(folder1, folder2, crop='none', spatial_params=None):
 	for i, (img1, img2) in enumerate(zip(folder1_images, folder2_images)):
 		if img2 != img1:
 			print(f'{i}: {folder2}/{img2} -> {img1}')
-			os.rename(f'{folder2}/{img2}', f'{folder2}/{img1}')
+			if not dry_run:
+				os.rename(f'{folder2}/{img2}', f'{folder2}/{img1}')
 
 	# reload image list
-	folder2_images = [f for f in os.listdir(folder2) if os.path.isfile(os.path.join(folder2, f))
-					and f.lower().endswith(image_extensions)]
+	folder2_images = list(folder1_images) if dry_run else list_images(folder2)
 
 	# rotate images based on embedded EXIF data, this allows us to copy EXIF data to
 	# stereo images without overwriting rotation metadata and messing up rotation later
 	# this uses jpegtran which does this step LOSSLESSLY
 	print("\nStep 2: Rotating images...")
 
-	for i, img1 in enumerate(folder1_images):
-		get_rotation_cmd = ['exiftool', '-Orientation#', '-s', '-s', '-s', f'{folder1}/{img1}']
-		transform = orientation_to_jpegtran_arg(int(run_command(get_rotation_cmd)))
-		if transform:
-			print(f'{i}: Rotating: {img1}')
-			jpeg_transform_cmd = ['jpegtran', '-copy', 'all', transform, '-outfile', 'rotated.jpg',  f'{folder1}/{img1}']
-			jpeg_transform_cmd = [elem for item in jpeg_transform_cmd for elem in (item if isinstance(item, list) else [item])]
-			run_command(jpeg_transform_cmd)
-			# remove orientation flag if we rotated the image
-			reset_exif_cmd = ['exiftool', '-Orientation=1', '-n', '-overwrite_original', 'rotated.jpg']
-			run_command(reset_exif_cmd)
-			os.rename('rotated.jpg', f'{folder1}/{img1}')
-	for i, img2 in enumerate(folder2_images):
-		get_rotation_cmd = ['exiftool', '-Orientation#', '-s', '-s', '-s', f'{folder2}/{img2}']
-		transform = orientation_to_jpegtran_arg(int(run_command(get_rotation_cmd)))
-		if transform:
-			print(f'{i}: Rotating: {img2}')
-			jpeg_transform_cmd = ['jpegtran', '-copy', 'all', transform, '-outfile', 'rotated.jpg',  f'{folder2}/{img2}']
-			jpeg_transform_cmd = [elem for item in jpeg_transform_cmd for elem in (item if isinstance(item, list) else [item])]
-			run_command(jpeg_transform_cmd)
-			# remove orientation flag if we rotated the image
-			reset_exif_cmd = ['exiftool', '-Orientation=1', '-n', '-overwrite_original', 'rotated.jpg']
-			run_command(reset_exif_cmd)
-			os.rename('rotated.jpg', f'{folder2}/{img2}')
+	# temporary file -> original image, for every rotation not moved into place yet
+	rotations = {}
+	try:
+		# a dry run doesn't read the orientations, so no rotations are planned
+		with ExifToolDaemon(dry_run=dry_run) as exiftool:
+			image_paths = [f'{folder1}/{img1}' for img1 in folder1_images] + [f'{folder2}/{img2}' for img2 in folder2_images]
+			orientations = read_orientations(exiftool, image_paths)
+
+			# an unreadable image would silently keep its wrong rotation, so stop instead
+			unreadable = [image_path for image_path in image_paths if image_path not in orientations]
+			if unreadable and not dry_run:
+				for image_path in unreadable:
+					print(f"Error: Could not read the orientation of {image_path}")
+				sys.exit(1)
+
+			# both folders are queued on the same pool, so they are rotated in parallel
+			with ThreadPoolExecutor(max_workers=jobs) as executor:
+				futures = rotate_all(executor, folder1, folder1_images, orientations, rotations, verbose)
+				futures.update(rotate_all(executor, folder2, folder2_images, orientations, rotations, verbose))
+
+				rotated = [futures[future] for future in as_completed(futures) if future.result()]
+
+			# remove orientation flag from every rotated copy in one command, before they
+			# replace the originals, so an interrupted run can't leave a rotated image that
+			# still asks to be rotated and gets rotated again on the next run
+			if rotated:
+				reset_exif_cmd = ['-Orientation=1', '-n', '-overwrite_original', *rotated]
+				if run_exiftool(exiftool, reset_exif_cmd) is not None:
+					for rotated_path in rotated:
+						image_path = rotations[rotated_path]
+						# mkstemp creates the file private to the user, keep the original permissions
+						shutil.copymode(image_path, rotated_path)
+						os.replace(rotated_path, image_path)
+						del rotations[rotated_path]
+	finally:
+		# remove what is left of failed or interrupted rotations
+		for rotated_path in rotations:
+			with contextlib.suppress(FileNotFoundError):
+				os.unlink(rotated_path)
 
 	# align the images, this is important unless the cameras are perfectly aligned!
 	# this stores the output as a TIFF to avoid generation loss at the cost of a
 	# large temporary file
 	print("\nStep 3: Align images...")
 
+	align_cmds = []
 	for i, img_name in enumerate(folder1_images):
 		img1_path = os.path.join(folder1, img_name)
 		img2_path = os.path.join(folder2, img_name)
@@ -139,7 +242,10 @@ def process_images(folder1, folder2, crop='none', spatial_params=None):
 			'10',
 			output_file
 		]
-		run_command(align_cmd)
+		align_cmds.append(align_cmd)
+
+	with ThreadPoolExecutor(max_workers=jobs) as executor:
+		list(executor.map(lambda align_cmd: run_command(align_cmd, verbose=verbose, dry_run=dry_run), align_cmds))
 
 	if crop != 'none':
 		# crop images to specified height
@@ -148,6 +254,10 @@ def process_images(folder1, folder2, crop='none', spatial_params=None):
 		for i, img_name in enumerate(folder1_images):
 			name, _ = os.path.splitext(img_name)
 			file_path = os.path.join(folder1, name + '-sbs.tiff')
+			if dry_run:
+				print(f'Would crop {file_path} ({crop})')
+				continue
+
 			with Image.open(file_path) as img:
 				width, height = img.size
 				aspect_ratio = (width / 2) / height
@@ -169,42 +279,64 @@ def process_images(folder1, folder2, crop='none', spatial_params=None):
 	# metadata, but give precedence to the LEFT camera, without doing
 	# it at this point, the alignment step removes the metadata
 	print("\nStep 5: Copy EXIF data to output images...")
+	exiftool_cmds = []
 	for i, img_name in enumerate(folder1_images):
 		img1_path = os.path.join(folder1, img_name)
 		name, _ = os.path.splitext(img_name)
 		output_file = os.path.join(folder1, name + '-sbs.tiff')
 		exiftool_cmd = [
-			"exiftool",
 			"-overwrite_original",
 			"-TagsFromFile",
 			img1_path,
 			"-all:all",
 			output_file
 		]
-		run_command(exiftool_cmd)
+		exiftool_cmds.append(exiftool_cmd)
+
+	# send every copy to exiftool as one batch
+	with ExifToolDaemon(dry_run=dry_run) as exiftool:
+		for img_name, output in zip(folder1_images, exiftool.execute_many(exiftool_cmds)):
+			if ExifToolDaemon.errors(output):
+				print(f"Error copying EXIF data to {img_name}: {output.strip()}")
 
 	# convert the TIFF file to a spatial image in a HEIF container
 	# compatible with Apple devices
+	failed_count = 0
 	if spatial_params:
 		print("\nStep 6: Running spatialPhotoTool on matching image pairs...")
 
-		for i, img_name in enumerate(folder1_images):
-			img1_path = os.path.join(folder1, img_name)
-			name, _ = os.path.splitext(img_name)
-			output_file = os.path.join(folder1, name + '-sbs.tiff')
-
-			# Build the spatialPhotoTool command
-			spatial_cmd = [
-				"spatialPhotoTool",
-				"-s", str(spatial_params["s"]),
-				"-f", str(spatial_params["f"]),
-				"-b", str(spatial_params["b"]),
-				output_file
-			]
-			run_command(spatial_cmd)
-
-			if (i + 1) % 5 == 0 or i + 1 == len(folder1_images):
-				print(f"  Processed {i + 1}/{len(folder1_images)} image pairs")
+		with ThreadPoolExecutor(max_workers=jobs) as executor:
+			futures = {}
+			for i, img_name in enumerate(folder1_images):
+				img1_path = os.path.join(folder1, img_name)
+				name, _ = os.path.splitext(img_name)
+				output_file = os.path.join(folder1, name + '-sbs.tiff')
+
+				# Build the spatialPhotoTool command
+				spatial_cmd = [
+					"spatialPhotoTool",
+					"-s", str(spatial_params["s"]),
+					"-f", str(spatial_params["f"]),
+					"-b", str(spatial_params["b"]),
+					output_file
+				]
+				futures[executor.submit(run_command, spatial_cmd, verbose=verbose, dry_run=dry_run)] = img_name
+
+			for i, future in enumerate(as_completed(futures)):
+				try:
+					# run_command already reported a failing command
+					if not future.result():
+						failed_count += 1
+				except Exception as e:
+					print(f"Error running spatialPhotoTool on {futures[future]}: {e}")
+					failed_count += 1
+
+				if (i + 1) % 5 == 0 or i + 1 == len(folder1_images):
+					print(f"  Processed {i + 1}/{len(folder1_images)} image pairs")
+
+	if failed_count:
+		print(f"\nProcessing finished with {failed_count} failed image pairs.")
+		sys.exit(1)
 
 	print("\nAll processing steps completed successfully!")
 
@@ -220,6 +352,9 @@ def main():
 	parser.add_argument('-b', type=float, default=105.0, help='Baseline/IPD parameter for spatial image (default: 105.0)')
 	parser.add_argument('-c', type=str, default='none', help='crop alignment (none|top|middle|bottom) (default: none)')
 	parser.add_argument('--skip-spatial', action='store_true', help='Skip conversion to spatial image')
+	parser.add_argument('--jobs', '-j', type=positive_int, default=DEFAULT_JOBS, help=f'Number of external tools to run concurrently (default: {DEFAULT_JOBS})')
+	parser.add_argument('--verbose', '-v', action='store_true', help='Show the output of the external tools')
+	parser.add_argument('--dry-run', '-n', action='store_true', help='Only print the commands that would be run, without changing any files')
 
 	# Parse arguments
 	args = parser.parse_args()
@@ -236,7 +371,7 @@ def main():
 			"b": args.b
 		}
 
-	process_images(args.folder1, args.folder2, args.c, spatial_params)
+	process_images(args.folder1, args.folder2, args.c, spatial_params, args.jobs, args.verbose, args.dry_run)
 
 if __name__ == "__main__":
 	main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Helpers shared by a16spatial.py and slrspatial.py for running the external tools.
+"""
+import argparse
+import os
+import shlex
+import subprocess
+from collections import deque
+
+# each worker just waits on an external process, so threads are enough; use half
+# the cores by default to avoid thrashing when the tools are multithreaded
+DEFAULT_JOBS = max(1, (os.cpu_count() or 2) // 2)
+
+# number of output lines kept from a quiet command to report if it fails
+OUTPUT_TAIL_LINES = 20
+
+def positive_int(value):
+	"""
+	argparse type for counts that must be at least 1.
+	"""
+	number = int(value)
+	if number < 1:
+		raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+	return number
+
+def stream_command(command, verbose=False, dry_run=False):
+	"""
+	Run an external tool, streaming its output instead of buffering all of it in memory.
+
+	Args:
+		command (list[str]): Command to run
+		verbose (bool): If True, echo the output as it is produced, otherwise only the
+			last few lines are kept to report if the command fails
+		dry_run (bool): If True, only print the command without running it
+
+	Raises:
+		subprocess.CalledProcessError: If the command exits with a non-zero status
+	"""
+	if dry_run:
+		print(shlex.join(command))
+		return subprocess.CompletedProcess(command, 0)
+
+	tail = deque(maxlen=OUTPUT_TAIL_LINES)
+	with subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1) as process:
+		for line in process.stdout:
+			if verbose:
+				print(line, end='')
+			tail.append(line)
+
+	if process.returncode != 0:
+		raise subprocess.CalledProcessError(process.returncode, command, "".join(tail))
+
+	return subprocess.CompletedProcess(command, process.returncode)